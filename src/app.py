@@ -1,25 +1,86 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import datetime
+import json
 import os
+import time
+from dataclasses import dataclass
 
 from dotenv import load_dotenv
 from logzero import logger
 from telegram import ReplyKeyboardMarkup, Update
 from telegram._linkpreviewoptions import LinkPreviewOptions
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+from core.archive import EditionArchive
 from core.config import Config
+from core.edition import Edition
 from core.summarize import summarize
+from helpers.profiling import JobProfiler
 from helpers.utils import (
+    async_file_lock,
     datetime_to_str,
     load_json,
     save_as_json,
     str_to_datetime,
+    update_json,
+)
+from helpers.workers import (
+    LeaderLock,
+    check_worker_config,
+    is_own_chat,
+    is_primary_worker,
 )
 
 load_dotenv()
 
+leader_lock = LeaderLock()
+profiler = JobProfiler()
+archive = EditionArchive()
+PROFILABLE_JOBS = ["summarize", "send"]
+COPY_MESSAGES_LIMIT = 100
+
+
+def payload_size(params: dict) -> int:
+    """Size of a Bot API request's JSON-serialised parameters."""
+    params = {k: v.to_dict() if hasattr(v, "to_dict") else v for k, v in params.items()}
+    return len(json.dumps(params, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+@dataclass
+class FanoutStats:
+    copied_chats: int = 0
+    copy_requests: int = 0
+    copy_bytes: int = 0
+    copy_duration: float = 0.0
+    direct_chats: int = 0
+    direct_requests: int = 0
+    direct_bytes: int = 0
+    direct_duration: float = 0.0
+    copy_fallbacks: int = 0
+    failed_chats: int = 0
+
+    def record_copy(self, params: dict) -> None:
+        self.copy_requests += 1
+        self.copy_bytes += payload_size(params)
+
+    def record_direct(self, params: dict) -> None:
+        self.direct_requests += 1
+        self.direct_bytes += payload_size(params)
+
+    def __str__(self):
+        copy_avg = self.copy_duration / max(self.copied_chats, 1)
+        direct_avg = self.direct_duration / max(self.direct_chats, 1)
+        return (
+            f"copied to {self.copied_chats} chats ({self.copy_requests} requests, "
+            f"{self.copy_bytes} B, {copy_avg:.3f}s/chat), "
+            f"sent directly to {self.direct_chats} chats ({self.direct_requests} "
+            f"requests, {self.direct_bytes} B, {direct_avg:.3f}s/chat), "
+            f"{self.copy_fallbacks} copy fallbacks, {self.failed_chats} failed chats"
+        )
+
 
 async def warn(text: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.bot.send_message(Config.ADMIN_CHAT_ID, f"[Warning] {text}")
@@ -27,23 +88,110 @@ async def warn(text: str, context: ContextTypes.DEFAULT_TYPE) -> None:
     return None
 
 
-async def send_news_to_chat(
+def new_subscription() -> dict:
+    return {"last_sent": "1900-01-01 00:00:00", "keywords": [], "publishers": []}
+
+
+def get_subscription(subscribers: dict, chat_id: str) -> dict:
+    """Subscription of `chat_id`, upgrading the old bare last-sent string."""
+    subscription = subscribers[chat_id]
+    if isinstance(subscription, str):
+        subscription = {**new_subscription(), "last_sent": subscription}
+        subscribers[chat_id] = subscription
+    return subscription
+
+
+def has_filters(subscription: dict) -> bool:
+    return bool(subscription["keywords"] or subscription["publishers"])
+
+
+async def stage_edition(edition: Edition, context: ContextTypes.DEFAULT_TYPE) -> list:
+    """Post the edition once to the staging channel and return its message ids.
+
+    The ids are shared through Config.STAGING_FILE so that only one worker
+    posts each edition.
+    """
+    edition_key = datetime_to_str(edition.last_updated)
+    async with async_file_lock(Config.STAGING_FILE):
+        if os.path.exists(Config.STAGING_FILE):
+            staged = load_json(Config.STAGING_FILE)
+        else:
+            staged = {}
+        if staged.get("last_updated") != edition_key:
+            message_ids = []
+            for chunks in edition.summaries:
+                message = await context.bot.send_message(
+                    Config.STAGING_CHAT_ID, "".join(chunks), parse_mode="MarkdownV2"
+                )
+                message_ids.append(message.message_id)
+            staged = {"last_updated": edition_key, "message_ids": message_ids}
+            save_as_json(staged, Config.STAGING_FILE)
+            logger.info(f"Staged edition {edition_key} as messages {message_ids}.")
+    return staged["message_ids"]
+
+
+async def copy_news_to_chat(
     chat_id: str,
     context: ContextTypes.DEFAULT_TYPE,
-    last_sent="1900-01-01 00:00:00",
-    by_chunks=False,
+    message_ids: list,
+    stats: FanoutStats,
 ) -> None:
-    summaries = load_json(Config.SUMMARIES_FILE)
-    last_sent = str_to_datetime(last_sent)
-    last_updated = str_to_datetime(summaries["last_updated"])
-    summaries = summaries["summaries"]
+    start_time = time.time()
+    for i in range(0, len(message_ids), COPY_MESSAGES_LIMIT):
+        batch = message_ids[i : i + COPY_MESSAGES_LIMIT]
+        await context.bot.copy_messages(chat_id, Config.STAGING_CHAT_ID, batch)
+        stats.record_copy(
+            dict(
+                chat_id=chat_id, from_chat_id=Config.STAGING_CHAT_ID, message_ids=batch
+            )
+        )
+    stats.copied_chats += 1
+    stats.copy_duration += time.time() - start_time
+    return None
 
-    if not summaries:
+
+async def send_news_to_chat(
+    chat_id: str,
+    context: ContextTypes.DEFAULT_TYPE,
+    subscription: dict = None,
+    by_chunks=False,
+    edition: Edition = None,
+    staged_message_ids: list = None,
+    stats: FanoutStats = None,
+    record_sent: bool = True,
+) -> bool:
+    """Deliver the edition to `chat_id`, returning whether anything was due.
+
+    The fan-out passes `record_sent=False` and records its chats in one write.
+    """
+    if subscription is None:
+        subscription = new_subscription()
+    if stats is None:
+        stats = FanoutStats()
+    if edition is None:
+        edition = Edition.load()
+    last_sent = str_to_datetime(subscription["last_sent"])
+    last_updated = edition.last_updated
+
+    if not edition.summaries:
         warn("Cannot find headlines to summarize.", context)
-        return None
+        return False
     if last_sent > last_updated:
         warn(f"No new news for {chat_id}. {last_sent=}, {last_updated=}", context)
-        return None
+        return False
+    summaries = edition.personalise(
+        subscription["keywords"], subscription["publishers"]
+    )
+    if not summaries:
+        logger.info(f"No news matching the filters of {chat_id}.")
+    if staged_message_ids and not by_chunks and not has_filters(subscription):
+        try:
+            await copy_news_to_chat(chat_id, context, staged_message_ids, stats)
+            summaries = []
+        except BadRequest as e:
+            logger.warning(f"Cannot copy edition to {chat_id}: {e}. Sending directly.")
+            stats.copy_fallbacks += 1
+    start_time = time.time()
     for chunks in summaries:
         if by_chunks:
             text = chunks[0]
@@ -54,16 +202,39 @@ async def send_news_to_chat(
                 ),
             )
             topic_message = await context.bot.send_message(chat_id, text, **api_kwargs)
+            stats.record_direct(dict(chat_id=chat_id, text=text, **api_kwargs))
             for chunk in chunks[1:]:
                 text += chunk
                 await topic_message.edit_text(text, **api_kwargs)
+                stats.record_direct(
+                    dict(
+                        chat_id=chat_id,
+                        message_id=topic_message.message_id,
+                        text=text,
+                        **api_kwargs,
+                    )
+                )
         else:
             text = "".join(chunks)
             await context.bot.send_message(chat_id, text, parse_mode="MarkdownV2")
-
-    subscribers = load_json(Config.SUBSCRIBER_FILE)
-    subscribers[chat_id] = datetime_to_str(datetime.datetime.now())
-    save_as_json(subscribers, Config.SUBSCRIBER_FILE)
+            stats.record_direct(
+                dict(chat_id=chat_id, text=text, parse_mode="MarkdownV2")
+            )
+    if summaries:
+        stats.direct_chats += 1
+        stats.direct_duration += time.time() - start_time
+    if record_sent:
+        await asyncio.to_thread(mark_sent, [chat_id])
+    return True
+
+
+def mark_sent(chat_ids: list) -> None:
+    """Record one delivery time for `chat_ids` in a single locked write."""
+    now = datetime_to_str(datetime.datetime.now())
+    with update_json(Config.SUBSCRIBER_FILE) as subscribers:
+        for chat_id in chat_ids:
+            if chat_id in subscribers:
+                get_subscription(subscribers, chat_id)["last_sent"] = now
     return None
 
 
@@ -74,27 +245,77 @@ def is_subscriber(chat_id: str) -> bool:
 
 
 def subscribe(chat_id: str) -> bool:
-    subscribers = load_json(Config.SUBSCRIBER_FILE)
-    subscribers[chat_id] = "1900-01-01 00:00:00"
-    save_as_json(subscribers, Config.SUBSCRIBER_FILE)
+    with update_json(Config.SUBSCRIBER_FILE) as subscribers:
+        subscribers[chat_id] = new_subscription()
     return None
 
 
 def unsubscribe(chat_id: str) -> bool:
+    with update_json(Config.SUBSCRIBER_FILE) as subscribers:
+        subscribers.pop(chat_id)
+    return None
+
+
+async def send_news_to_own_subscribers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Every worker runs this job and delivers to its own share of the chats.
+    edition = Edition.load()
     subscribers = load_json(Config.SUBSCRIBER_FILE)
-    subscribers.pop(chat_id)
-    save_as_json(subscribers, Config.SUBSCRIBER_FILE)
+    stats = FanoutStats()
+    staged_message_ids = None
+    if Config.STAGING_CHAT_ID and edition.summaries:
+        try:
+            staged_message_ids = await stage_edition(edition, context)
+        except TelegramError as e:
+            logger.warning(f"Cannot stage edition: {e}. Sending directly.")
+    sent_chat_ids = []
+    for chat_id in subscribers:
+        if not is_own_chat(chat_id):
+            continue
+        subscription = get_subscription(subscribers, chat_id)
+        try:
+            sent = await send_news_to_chat(
+                chat_id,
+                context,
+                subscription,
+                edition=edition,
+                staged_message_ids=staged_message_ids,
+                stats=stats,
+                record_sent=False,
+            )
+        except RetryAfter as e:
+            # Flood control applies to the whole bot, so hold off the rest too.
+            logger.warning(f"Rate limited at {chat_id}. Waiting {e.retry_after}s.")
+            stats.failed_chats += 1
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramError as e:
+            logger.warning(f"Cannot send news to {chat_id}: {e}")
+            stats.failed_chats += 1
+            continue
+        if sent:
+            sent_chat_ids.append(chat_id)
+    if sent_chat_ids:
+        await asyncio.to_thread(mark_sent, sent_chat_ids)
+    logger.info(f"Fan-out: {stats}")
+    return None
+
+
+async def send_profile_report(report, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.bot.send_message(Config.ADMIN_CHAT_ID, report.to_message())
     return None
 
 
 async def send_news_to_all_subscribers(context: ContextTypes.DEFAULT_TYPE) -> None:
-    for chat_id, last_sent in load_json(Config.SUBSCRIBER_FILE).items():
-        await send_news_to_chat(chat_id, context, last_sent)
+    if profiler.should_profile("send"):
+        _, report = await profiler.run("send", send_news_to_own_subscribers, context)
+        await send_profile_report(report, context)
+    else:
+        await send_news_to_own_subscribers(context)
     return None
 
 
 async def subscribe_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_message.chat_id
+    chat_id = str(update.effective_message.chat_id)
     if is_subscriber(chat_id):
         return
     subscribe(chat_id)
@@ -113,6 +334,61 @@ async def unsubscribe_handler(
     return
 
 
+def set_filter(chat_id: str, field: str, values: list[str]) -> None:
+    with update_json(Config.SUBSCRIBER_FILE) as subscribers:
+        get_subscription(subscribers, chat_id)[field] = values
+    return None
+
+
+def describe_filters(subscription: dict) -> str:
+    keywords = "、".join(subscription["keywords"]) or "全部"
+    publishers = "、".join(subscription["publishers"]) or "全部"
+    return f"關鍵字：{keywords}\n來源：{publishers}"
+
+
+async def filter_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = str(update.effective_message.chat_id)
+    if not is_subscriber(chat_id):
+        await update.effective_message.reply_text("您還未訂閱")
+        return None
+    command = update.effective_message.text.split()[0].lstrip("/").split("@")[0]
+    if command in ("keywords", "publishers"):
+        # No arguments clears the filter.
+        set_filter(chat_id, command, list(dict.fromkeys(context.args)))
+    subscription = get_subscription(load_json(Config.SUBSCRIBER_FILE), chat_id)
+    await update.effective_message.reply_text(describe_filters(subscription))
+    return None
+
+
+async def history_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    usage = "用法：/history YYYY-MM-DD [HH:MM]"
+    try:
+        day = datetime.datetime.strptime(context.args[0], "%Y-%m-%d").date()
+        at = (
+            datetime.datetime.strptime(context.args[1], "%H:%M").time()
+            if len(context.args) > 1
+            else datetime.time.max
+        )
+    except (IndexError, ValueError):
+        await update.effective_message.reply_text(usage)
+        return None
+    data = archive.latest_before(
+        datetime.datetime.combine(day, at).replace(microsecond=0), on=day
+    )
+    if data is None:
+        await update.effective_message.reply_text(f"找不到 {day} 的新聞摘要")
+        return None
+    edition = Edition.from_dict(data)
+    await update.effective_message.reply_text(
+        f"{datetime_to_str(edition.last_updated)} 的新聞摘要"
+    )
+    for chunks in edition.summaries:
+        await update.effective_message.reply_text(
+            "".join(chunks), parse_mode="MarkdownV2"
+        )
+    return None
+
+
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome_message = "歡迎使用香港日報 Bot！我每天會為您提供新聞摘要和相關連結。"
     await update.message.reply_text(
@@ -125,7 +401,13 @@ async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_message.chat_id)
     if is_subscriber(chat_id):
-        message = "您已訂閱"
+        message = (
+            "您已訂閱\n"
+            "/keywords 關鍵字 ... 只接收包含關鍵字的新聞\n"
+            "/publishers 來源 ... 只接收指定來源的新聞\n"
+            "/filters 查看篩選設定\n"
+            "/history YYYY-MM-DD 查看過往新聞摘要"
+        )
         buttons = [["/unsubscribe 取消訂閱"]]
     else:
         message = "您還未訂閱"
@@ -146,8 +428,37 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"{type(context.error).__name__}: {context.error}")
 
 
+async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_message.chat_id)
+    if chat_id != Config.ADMIN_CHAT_ID:
+        return None
+    jobs = context.args or PROFILABLE_JOBS
+    unknown_jobs = [job for job in jobs if job not in PROFILABLE_JOBS]
+    if unknown_jobs:
+        await update.effective_message.reply_text(
+            f"Unknown job {', '.join(unknown_jobs)}. "
+            f"Usage: /profile [{'|'.join(PROFILABLE_JOBS)}]"
+        )
+        return None
+    for job in jobs:
+        profiler.arm(job)
+    await update.effective_message.reply_text(
+        f"Profiler armed for the next {', '.join(jobs)} job."
+    )
+    return None
+
+
 async def summarize_handler(context: ContextTypes.DEFAULT_TYPE):
-    summarize()
+    if not leader_lock.is_leader():
+        logger.info(f"Worker {Config.WORKER_ID} is not the leader. Skip summarize.")
+        return None
+    # summarize() blocks on Chrome and the LLM and runs its own event loop for
+    # article fetching, so keep it off the bot's loop.
+    if profiler.should_profile("summarize"):
+        _, report = await profiler.run("summarize", summarize, archive)
+        await send_profile_report(report, context)
+    else:
+        await asyncio.to_thread(summarize, archive)
     return None
 
 
@@ -166,21 +477,46 @@ def schedule_jobs(application: Application) -> None:
         logger.info(f"Summarization scheduled at {time}.")
 
 
+async def run_without_polling(application: Application) -> None:
+    async with application:
+        await application.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await application.stop()
+
+
 def main():
     load_dotenv()
+    check_worker_config()
     TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN)
+    if not is_primary_worker():
+        # Telegram allows a single getUpdates consumer per token, so secondary
+        # workers only run the job queue.
+        builder = builder.updater(None)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start_handler))
     application.add_handler(CommandHandler("help", help_handler))
     application.add_handler(CommandHandler("subscribe", subscribe_handler))
     application.add_handler(CommandHandler("unsubscribe", unsubscribe_handler))
+    application.add_handler(
+        CommandHandler(["filters", "keywords", "publishers"], filter_handler)
+    )
+    application.add_handler(CommandHandler("history", history_handler))
+    application.add_handler(CommandHandler("profile", profile_handler))
     application.add_error_handler(error_handler)
 
     schedule_jobs(application)
 
-    logger.info("Bot started successfully.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    logger.info(
+        f"Bot worker {Config.WORKER_ID}/{Config.WORKER_COUNT} started successfully."
+    )
+    if is_primary_worker():
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        asyncio.run(run_without_polling(application))
 
 
 if __name__ == "__main__":
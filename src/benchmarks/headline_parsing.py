@@ -0,0 +1,110 @@
+"""Benchmark stream headline parsing against the previous per-item XPath code.
+
+Usage (from ./src):
+    python -m benchmarks.headline_parsing [saved_stream.html]
+
+A saved `stream-container-scroll-template` innerHTML can be passed in; its
+stream items are repeated to reach each size. Without it a synthetic stream
+with the same structure is used.
+"""
+
+import sys
+import time
+from io import StringIO
+from urllib.parse import unquote
+
+from lxml import etree
+
+from core.schema import Headline
+from core.scraper import AD_SUMMARY, STREAM_ITEM_XPATH, parse_headlines
+
+BASE_URL = "https://hk.news.yahoo.com"
+SIZES = [100, 1_000, 10_000]
+REPEAT = 5
+
+SYNTHETIC_ITEM = (
+    '<li class="js-stream-content"><div><div><div>'
+    "<div><img/></div>"
+    "<div>"
+    "<div>星島日報 • 3 小時前</div>"
+    '<h3><a href="/news-{i}.html">標題 <span>{i}</span></a></h3>'
+    "<p>新聞摘要 {i}</p>"
+    "</div>"
+    "<div></div>"
+    "</div></div></div></li>"
+)
+AD_ITEM = (
+    '<li class="StreamAd"><div><div><div><div></div><div></div></div></div></div></li>'
+)
+
+
+def legacy_parse_headlines(html: str, base_url: str) -> list[Headline]:
+    tree = etree.parse(StringIO(html), etree.HTMLParser())
+    elements = tree.xpath(
+        "//li[not(contains(@class, 'StreamAd'))]/div/div/div/div[position() = (last() - 1)]"
+    )
+    headlines = []
+    for e in elements:
+        summary = (e.xpath("./p")[0].text or "").strip()
+        if summary == AD_SUMMARY:
+            continue
+        title = "".join(e.xpath("./h3")[0].itertext()).strip()
+        publisher, time = (e.xpath("./div")[0].text or "").strip().split(" • ")
+        headlines.append(
+            Headline(
+                publisher=publisher,
+                time=time,
+                title=title,
+                link=unquote(base_url + e.xpath("./h3/a")[0].get("href")),
+                summary=summary,
+            )
+        )
+    return headlines
+
+
+def load_items(path: str | None) -> list[str]:
+    if path is None:
+        return [SYNTHETIC_ITEM.format(i=i) for i in range(50)] + [AD_ITEM]
+    with open(path, "r", encoding="utf-8") as f:
+        tree = etree.fromstring(f.read(), etree.HTMLParser())
+    items = [
+        etree.tostring(
+            e.getparent().getparent().getparent().getparent(), encoding="unicode"
+        )
+        for e in STREAM_ITEM_XPATH(tree)
+    ]
+    if not items:
+        raise ValueError(f"No stream items found in {path}.")
+    return items
+
+
+def build_stream(items: list[str], n: int) -> str:
+    body = "".join(items[i % len(items)] for i in range(n))
+    return f"<ul>{body}</ul>"
+
+
+def best_of(func, html: str) -> tuple[float, int]:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        headlines = func(html, BASE_URL)
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(headlines)
+
+
+def main():
+    items = load_items(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"{'items':>8} {'legacy (ms)':>12} {'fast (ms)':>10} {'speedup':>8}")
+    for n in SIZES:
+        html = build_stream(items, n)
+        legacy_sec, legacy_count = best_of(legacy_parse_headlines, html)
+        fast_sec, fast_count = best_of(parse_headlines, html)
+        assert legacy_count == fast_count, (legacy_count, fast_count)
+        print(
+            f"{n:>8} {legacy_sec * 1000:>12.2f} {fast_sec * 1000:>10.2f} "
+            f"{legacy_sec / fast_sec:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
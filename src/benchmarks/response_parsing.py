@@ -0,0 +1,196 @@
+"""Check and time the tolerant LLM response parser on a corpus of bad output.
+
+Usage (from ./src):
+    python -m benchmarks.response_parsing
+
+Each corpus entry lists the topics that should survive validation. The old
+`capture_code` + `json.loads` path is timed alongside for comparison.
+"""
+
+import json
+import time
+
+from core.response import (
+    ResponseParseError,
+    load_response_json,
+    validate_cluster_topics,
+    validate_topics,
+)
+from helpers.utils import capture_code
+
+N_HEADLINES = 50
+REPEAT = 2_000
+
+VALID = """{
+    "颱風": {"總結": "颱風襲港。", "標題索引": [0, 2, 3]},
+    "股市": {"總結": "恒指上升。", "標題索引": [5, 10]}
+}"""
+
+# (name, response, expected valid topics)
+CORPUS = [
+    ("valid", VALID, {"颱風", "股市"}),
+    ("code fence", f"```json\n{VALID}\n```", {"颱風", "股市"}),
+    ("surrounding prose", f"以下是結果：\n{VALID}\n希望有幫助！", {"颱風", "股市"}),
+    (
+        "trailing commas",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2,],}, "股市": {"總結": "b", "標題索引": [5],},}',
+        {"颱風", "股市"},
+    ),
+    (
+        "array of pairs from prompt",
+        '[\n    "颱風": {"總結": "a", "標題索引": [0,2,3,]},\n    "股市": {"總結": "b", "標題索引": [5]},\n    …\n]',
+        {"颱風", "股市"},
+    ),
+    (
+        "ellipsis placeholder",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2, ...]}, …}',
+        {"颱風"},
+    ),
+    (
+        "truncated",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2]}, "股市": {"總結": "b", "標題索引": [5, 1',
+        {"颱風", "股市"},
+    ),
+    (
+        "truncated in next key",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2]}, "股市": {"總結"',
+        {"颱風"},
+    ),
+    (
+        "truncated before next value",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2]}, "股市": {"總結": "b", "標題',
+        {"颱風"},
+    ),
+    (
+        "truncated after next key",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2]}, "股',
+        {"颱風"},
+    ),
+    (
+        "out of range indexes",
+        '{"颱風": {"總結": "a", "標題索引": [0, 999, -1]}, "股市": {"總結": "b", "標題索引": [999]}}',
+        {"颱風"},
+    ),
+    (
+        "string indexes",
+        '{"颱風": {"總結": "a", "標題索引": ["0", "2: 颱風襲港", "x"]}}',
+        {"颱風"},
+    ),
+    (
+        "missing summary",
+        '{"颱風": {"總結": "", "標題索引": [0]}, "股市": {"標題索引": [5]}, "天氣": "晴"}',
+        set(),
+    ),
+    (
+        "wrapped list",
+        '{"topics": [{"話題": "颱風", "總結": "a", "標題索引": [0]}]}',
+        {"颱風"},
+    ),
+    (
+        "mismatched brackets",
+        '{"颱風": {"總結": "a", "標題索引": [0, 2}}',
+        {"颱風"},
+    ),
+    (
+        "quotes and brackets in strings",
+        '{"颱風": {"總結": "八號風球 {信號} [生效], \\"注意\\"", "標題索引": [1],},}',
+        {"颱風"},
+    ),
+    ("not json", "抱歉，我無法回答。", set()),
+]
+
+CLUSTER_CORPUS = [
+    (
+        "clusters with missing one",
+        '{"0": {"話題": "颱風", "總結": "a"}, "1": {"話題": "股市"}, "2": {"總結": "c"},}',
+        {0, 2},
+    ),
+    (
+        "clusters keyed by name",
+        '{"話題0": {"話題": "颱風", "總結": "a"}, "話題1": {"話題": "股市", "總結": "b"}}',
+        {0, 1},
+    ),
+    (
+        "clusters truncated in next key",
+        '{"0": {"話題": "颱風", "總結": "a"}, "1": {"話題": "股市", "總',
+        {0},
+    ),
+    (
+        "clusters truncated before next value",
+        '{"0": {"話題": "颱風", "總結": "a"}, "1": {"話',
+        {0},
+    ),
+]
+
+
+def legacy_parse(response: str) -> set:
+    try:
+        data = json.loads(capture_code(response, "json"))
+        return {
+            topic
+            for topic, details in data.items()
+            if all(0 <= int(idx) < N_HEADLINES for idx in details["標題索引"])
+        }
+    except Exception:
+        return set()
+
+
+def tolerant_parse(response: str) -> set:
+    try:
+        topics, _ = validate_topics(load_response_json(response), N_HEADLINES)
+    except ResponseParseError:
+        return set()
+    return set(topics)
+
+
+def tolerant_parse_clusters(response: str) -> set:
+    try:
+        topics, _ = validate_cluster_topics(load_response_json(response), 3)
+    except ResponseParseError:
+        return set()
+    return set(topics)
+
+
+def best_time(func, response: str) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func(response)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def main():
+    failures = 0
+    print(f"{'case':<32} {'legacy':>6} {'fixed':>6} {'legacy us':>10} {'fixed us':>9}")
+    for name, response, expected in CORPUS:
+        legacy = legacy_parse(response)
+        parsed = tolerant_parse(response)
+        ok = parsed == expected
+        failures += not ok
+        print(
+            f"{name:<32} {len(legacy):>6} {len(parsed):>6} "
+            f"{best_time(legacy_parse, response):>10.1f} "
+            f"{best_time(tolerant_parse, response):>9.1f}"
+            + (
+                ""
+                if ok
+                else f"  FAIL: expected {sorted(expected)}, got {sorted(parsed)}"
+            )
+        )
+    for name, response, expected in CLUSTER_CORPUS:
+        parsed = tolerant_parse_clusters(response)
+        ok = parsed == expected
+        failures += not ok
+        print(
+            f"{name:<32} {'-':>6} {len(parsed):>6}"
+            + (
+                ""
+                if ok
+                else f"  FAIL: expected {sorted(expected)}, got {sorted(parsed)}"
+            )
+        )
+    if failures:
+        raise SystemExit(f"{failures} corpus cases failed.")
+
+
+if __name__ == "__main__":
+    main()
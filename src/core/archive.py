@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from datetime import date, datetime
+
+from core.config import Config
+from helpers.utils import datetime_to_str
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS editions (
+    id INTEGER PRIMARY KEY,
+    last_updated TEXT NOT NULL,
+    model TEXT,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS editions_last_updated ON editions (last_updated);
+CREATE TABLE IF NOT EXISTS edition_topics (
+    edition_id INTEGER NOT NULL REFERENCES editions (id),
+    topic TEXT NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edition_topics_topic ON edition_topics (topic);
+CREATE INDEX IF NOT EXISTS edition_topics_edition ON edition_topics (edition_id);
+"""
+
+
+def compress(data: dict) -> bytes:
+    text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(text.encode("utf-8"), 9)
+
+
+def decompress(payload: bytes) -> dict:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+class EditionArchive:
+    """Append-only archive of every edition in SQLite.
+
+    Each edition is stored as one zlib-compressed JSON blob, indexed by its
+    `last_updated` timestamp and by topic. Inserts are transactional, so a
+    crash never leaves a half-written edition, and WAL mode lets workers read
+    while another one appends.
+    """
+
+    def __init__(self, filename: str = Config.ARCHIVE_FILE) -> None:
+        self.filename = filename
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.filename, timeout=30)
+
+    def append(self, edition: dict) -> int:
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT INTO editions (last_updated, model, payload) VALUES (?, ?, ?)",
+                (edition["last_updated"], edition.get("model"), compress(edition)),
+            )
+            edition_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO edition_topics (edition_id, topic, summary) "
+                "VALUES (?, ?, ?)",
+                [
+                    (edition_id, topic["topic"], topic["summary"])
+                    for topic in edition.get("topics", [])
+                ],
+            )
+        return edition_id
+
+    def get(self, edition_id: int) -> dict | None:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT payload FROM editions WHERE id = ?", (edition_id,)
+            ).fetchone()
+        return decompress(row[0]) if row else None
+
+    def list_editions(self, start: datetime, end: datetime) -> list[tuple[int, str]]:
+        """`(id, last_updated)` of the editions in [start, end), oldest first."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT id, last_updated FROM editions "
+                "WHERE last_updated >= ? AND last_updated < ? ORDER BY last_updated",
+                (datetime_to_str(start), datetime_to_str(end)),
+            ).fetchall()
+
+    def latest_before(self, until: datetime, on: date = None) -> dict | None:
+        """Latest edition at or before `until`, optionally restricted to a day."""
+        since = datetime.combine(on, datetime.min.time()) if on else None
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT payload FROM editions "
+                "WHERE last_updated <= ? AND (? IS NULL OR last_updated >= ?) "
+                "ORDER BY last_updated DESC LIMIT 1",
+                (
+                    datetime_to_str(until),
+                    since and datetime_to_str(since),
+                    since and datetime_to_str(since),
+                ),
+            ).fetchone()
+        return decompress(row[0]) if row else None
+
+    def find_topic(self, keyword: str, limit: int = 20) -> list[tuple[int, str, str]]:
+        """`(id, last_updated, topic)` of recent editions, by topic prefix.
+
+        A range over the topic index rather than `LIKE`, which SQLite can only
+        serve by scanning every topic.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT e.id, e.last_updated, t.topic FROM edition_topics t "
+                "JOIN editions e ON e.id = t.edition_id "
+                "WHERE t.topic >= ? AND t.topic < ? "
+                "ORDER BY e.last_updated DESC LIMIT ?",
+                (keyword, keyword + chr(0x10FFFF), limit),
+            ).fetchall()
+
+
+if __name__ == "__main__":
+    # Seed the archive with the current live edition.
+    from helpers.utils import load_json
+
+    edition_id = EditionArchive().append(load_json(Config.SUMMARIES_FILE))
+    print(f"Archived {Config.SUMMARIES_FILE} as edition {edition_id}.")
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import httpx
+from logzero import logger
+from lxml import etree
+
+from core.config import Config
+from core.schema import Headline
+
+HTML_PARSER = etree.HTMLParser()
+# Yahoo article bodies live in `caas-body`; other publishers usually use <article>.
+PARAGRAPH_XPATHS = [
+    etree.XPath("//div[contains(@class, 'caas-body')]//p"),
+    etree.XPath("//article//p"),
+    etree.XPath("//p"),
+]
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+)
+
+
+@dataclass
+class FetchStats:
+    requested: int = 0
+    fetched: int = 0
+    not_modified: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    # Timed out, but served from the cache
+    stale: int = 0
+    duration: float = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.requested} articles: {self.fetched} fetched, "
+            f"{self.not_modified} cache hits, {self.failed} failed, "
+            f"{self.timed_out} timed out ({self.stale} served stale from cache) "
+            f"in {self.duration:.2f}s"
+        )
+
+
+def extract_text(html: str) -> str:
+    """Readable body text: the paragraphs of the most specific article container."""
+    tree = etree.fromstring(html, HTML_PARSER)
+    if tree is None:
+        return ""
+    for xpath in PARAGRAPH_XPATHS:
+        paragraphs = ["".join(p.itertext()).strip() for p in xpath(tree)]
+        paragraphs = [p for p in paragraphs if p]
+        if paragraphs:
+            return "\n".join(paragraphs)
+    return ""
+
+
+class ArticleCache:
+    """On-disk article cache keyed by URL, storing the response validators.
+
+    Reading an entry refreshes its mtime, so `prune` only drops articles no
+    recent edition has linked to.
+    """
+
+    def __init__(self, cache_dir: str = Config.ARTICLE_CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, url: str) -> dict | None:
+        path = self._path(url)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            os.utime(path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return cached
+
+    def prune(self, max_age_days: float = Config.ARTICLE_CACHE_MAX_AGE_DAYS) -> int:
+        """Delete entries not read or written within `max_age_days`."""
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+        removed = 0
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    # Pruned concurrently by another worker
+                    continue
+        return removed
+
+    def put(self, url: str, text: str, etag: str | None, last_modified: str | None):
+        path = self._path(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "url": url,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "text": text,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+
+
+async def fetch_article(
+    client: httpx.AsyncClient, cache: ArticleCache, url: str, stats: FetchStats
+) -> str | None:
+    cached = cache.get(url)
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        response = await client.get(url, headers=headers)
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to fetch {url}: {type(e).__name__}: {e}")
+        stats.failed += 1
+        return cached["text"] if cached else None
+
+    if response.status_code == 304 and cached:
+        stats.not_modified += 1
+        return cached["text"]
+    if response.status_code != 200:
+        logger.warning(f"Failed to fetch {url}: HTTP {response.status_code}")
+        stats.failed += 1
+        return cached["text"] if cached else None
+
+    text = extract_text(response.text)
+    cache.put(
+        url,
+        text,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+    stats.fetched += 1
+    return text
+
+
+async def fetch_articles(
+    headlines: list[Headline],
+    budget_sec: float = Config.ARTICLE_FETCH_BUDGET_SEC,
+    max_connections: int = Config.ARTICLE_MAX_CONNECTIONS,
+) -> tuple[dict[str, str], FetchStats]:
+    """Fetch article bodies concurrently within a hard overall time budget.
+
+    Returns a mapping of link to article text. Articles not done when the
+    budget runs out are cancelled and fall back to their cached text, if any.
+    """
+    cache = ArticleCache()
+    pruned = cache.prune()
+    if pruned:
+        logger.info(f"Pruned {pruned} stale articles from the cache.")
+    stats = FetchStats()
+    links = list(dict.fromkeys(h.link for h in headlines if h.link))
+    stats.requested = len(links)
+    start_time = time.time()
+
+    limits = httpx.Limits(
+        max_connections=max_connections, max_keepalive_connections=max_connections
+    )
+    async with httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(max(budget_sec, 1)),
+        follow_redirects=True,
+        headers={"User-Agent": USER_AGENT},
+    ) as client:
+        tasks = {
+            asyncio.create_task(fetch_article(client, cache, link, stats)): link
+            for link in links
+        }
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=budget_sec)
+        else:
+            done, pending = set(), set()
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        stats.timed_out = len(pending)
+
+    articles = {}
+    for task in done:
+        if task.exception() is not None:
+            logger.warning(f"Failed to fetch {tasks[task]}: {task.exception()}")
+            stats.failed += 1
+            continue
+        if task.result():
+            articles[tasks[task]] = task.result()
+    for task in pending:
+        cached = cache.get(tasks[task])
+        if cached and cached.get("text"):
+            articles[tasks[task]] = cached["text"]
+            stats.stale += 1
+    stats.duration = time.time() - start_time
+    logger.info(f"Article fetch: {stats}")
+    return articles, stats
+
+
+if __name__ == "__main__":
+    from helpers.utils import load_json
+
+    headlines = [Headline(**h) for h in load_json(Config.HEADLINES_FILE)["headlines"]]
+    articles, stats = asyncio.run(fetch_articles(headlines))
+    print(stats)
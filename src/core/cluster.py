@@ -0,0 +1,125 @@
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from core.config import Config
+from core.schema import Headline
+
+# Drop whitespace and punctuation (ASCII and full-width) before taking n-grams.
+NON_WORD_REGEX = re.compile(r"[\W_]+", re.UNICODE)
+
+
+@dataclass
+class Cluster:
+    # Headline indexes, most central first
+    indexes: list[int]
+    publishers: int
+
+    @property
+    def size(self):
+        return len(self.indexes)
+
+    @property
+    def representatives(self) -> list[int]:
+        """The headlines shown to the LLM for this cluster."""
+        return self.indexes[: Config.CLUSTER_REPRESENTATIVES]
+
+
+def char_ngrams(text: str, ngram_range=(2, 2)) -> list[str]:
+    text = NON_WORD_REGEX.sub("", text.lower())
+    ngrams = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        ngrams.extend(text[i : i + n] for i in range(len(text) - n + 1))
+    return ngrams or [text]
+
+
+def tfidf_matrix(titles: list[str]) -> np.ndarray:
+    """L2-normalised TF-IDF of character n-grams, one row per title."""
+    vocabulary = {}
+    rows, cols = [], []
+    for row, title in enumerate(titles):
+        for ngram in char_ngrams(title):
+            rows.append(row)
+            cols.append(vocabulary.setdefault(ngram, len(vocabulary)))
+
+    tf = np.zeros((len(titles), len(vocabulary)), dtype=np.float32)
+    np.add.at(tf, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1)
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(titles)) / (1 + df)) + 1
+    tfidf = tf * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return tfidf / norms
+
+
+def agglomerate(similarity: np.ndarray, threshold: float) -> list[list[int]]:
+    """Average-linkage agglomerative clustering on a cosine similarity matrix.
+
+    Merges the most similar pair of clusters until no pair is above
+    `threshold`. Ties resolve to the lowest index, so results are
+    deterministic for a given input order.
+    """
+    n = similarity.shape[0]
+    linkage = similarity.astype(np.float64)
+    np.fill_diagonal(linkage, -np.inf)
+    sizes = np.ones(n)
+    members = [[i] for i in range(n)]
+    active = np.ones(n, dtype=bool)
+
+    while active.sum() > 1:
+        best = int(np.argmax(linkage))
+        i, j = divmod(best, n)
+        if linkage[i, j] < threshold:
+            break
+        i, j = min(i, j), max(i, j)
+        merged = (linkage[i] * sizes[i] + linkage[j] * sizes[j]) / (sizes[i] + sizes[j])
+        linkage[i, :] = merged
+        linkage[:, i] = merged
+        linkage[i, i] = -np.inf
+        linkage[j, :] = -np.inf
+        linkage[:, j] = -np.inf
+        sizes[i] += sizes[j]
+        members[i].extend(members[j])
+        active[j] = False
+
+    return [members[i] for i in np.flatnonzero(active)]
+
+
+def cluster_headlines(
+    headlines: list[Headline],
+    n_clusters: int = Config.TOPIC_COUNT,
+    threshold: float = Config.CLUSTER_SIMILARITY_THRESHOLD,
+) -> list[Cluster]:
+    """Group headlines into topics and return the `n_clusters` largest.
+
+    Clusters are ranked by size, then by number of distinct publishers.
+    """
+    if not headlines:
+        return []
+    vectors = tfidf_matrix([h.title for h in headlines])
+    similarity = vectors @ vectors.T
+
+    clusters = []
+    for group in agglomerate(similarity, threshold):
+        centroid = vectors[group].mean(axis=0)
+        centrality = vectors[group] @ centroid
+        order = np.argsort(-centrality, kind="stable")
+        clusters.append(
+            Cluster(
+                indexes=[group[k] for k in order],
+                publishers=len({headlines[k].publisher for k in group}),
+            )
+        )
+    clusters.sort(key=lambda c: (-c.size, -c.publishers, min(c.indexes)))
+    return clusters[:n_clusters]
+
+
+if __name__ == "__main__":
+    from helpers.utils import load_json
+
+    headlines = [Headline(**h) for h in load_json(Config.HEADLINES_FILE)["headlines"]]
+    for cluster in cluster_headlines(headlines):
+        print(f"--- {cluster.size} headlines, {cluster.publishers} publishers")
+        for idx in cluster.indexes[: Config.CLUSTER_REPRESENTATIVES]:
+            print(headlines[idx].title)
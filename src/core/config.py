@@ -1,6 +1,10 @@
+import os
 from datetime import time
 
 import pytz
+from dotenv import load_dotenv
+
+load_dotenv()
 
 
 class Config:
@@ -8,6 +12,24 @@ class Config:
     SUBSCRIBER_FILE = "./data/subscribers.json"
     SUMMARIES_FILE = "./data/summaries.json"
     HEADLINES_FILE = "./data/headlines.json"
+    ARCHIVE_FILE = "./data/archive.sqlite3"
+    LEADER_LOCK_FILE = "./data/leader.lock"
+    PROFILE_DIR = "./data/profiles"
+    # Private channel the bot posts each edition to once, to copy it to
+    # subscribers from there. Unset to send every message directly.
+    STAGING_CHAT_ID = os.getenv("STAGING_CHAT_ID")
+    STAGING_FILE = "./data/staging.json"
+    ARTICLE_CACHE_DIR = "./data/articles"
+    ARTICLE_CACHE_MAX_AGE_DAYS = 7
+    ARTICLE_FETCH_BUDGET_SEC = 60
+    ARTICLE_MAX_CONNECTIONS = 8
+    ARTICLE_EXCERPT_CHARS = 200
+    # Group headlines locally and only ask the LLM to name/summarise topics
+    USE_PRECLUSTERING = True
+    TOPIC_COUNT = 5
+    HEADLINES_PER_TOPIC = 5
+    CLUSTER_SIMILARITY_THRESHOLD = 0.1
+    CLUSTER_REPRESENTATIVES = 3
     TIMEZONE = pytz.timezone("Asia/Hong_Kong")
     SEND_SCHEDULE = [
         time(7, 0, tzinfo=TIMEZONE),
@@ -17,3 +39,22 @@ class Config:
         time(6, 55, tzinfo=TIMEZONE),
         time(17, 40, tzinfo=TIMEZONE),
     ]
+    # LLM endpoints in order of preference, see core/llm.py
+    LLM_ENDPOINTS = ["gateway", "azure"]
+    # summarize() has one deadline for the whole edition: the next send time
+    # minus this margin. LLM_DEADLINE_SEC only applies to calls made without one.
+    EDITION_DEADLINE_MARGIN_SEC = 10
+    # Time kept for the LLM when budgeting the article fetch
+    LLM_RESERVED_SEC = 120
+    LLM_DEADLINE_SEC = 240
+    LLM_HEDGE_PERCENTILE = 90
+    LLM_HEDGE_MIN_SAMPLES = 5
+    LLM_HEDGE_DELAY_SEC = 60
+    LLM_BREAKER_FAILURES = 3
+    LLM_BREAKER_RESET_SEC = 600
+    # Re-prompts for topics missing from or invalid in the LLM response
+    LLM_REPAIR_ATTEMPTS = 1
+    # Multi-worker deployment: run WORKER_COUNT processes sharing ./data,
+    # each started with a distinct WORKER_ID in [0, WORKER_COUNT).
+    WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+    WORKER_ID = int(os.getenv("WORKER_ID", "0"))
@@ -0,0 +1,98 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from core.config import Config
+from core.index import HeadlineIndex
+from core.schema import Headline
+from helpers.utils import load_json, str_to_datetime
+
+MATCHED_TOPIC_SUMMARY = "其他您關注的新聞"
+
+
+def escape_markdown_v2(text):
+    """Escape special characters for MarkdownV2."""
+    escape_chars = r"_*[]()~`>#+-=|{}.!"
+    return re.sub(r"(?<!\\)([{}])".format(re.escape(escape_chars)), r"\\\1", text)
+
+
+def render_topic(
+    summary: str, headline_idxs: list[int], headlines: list[Headline]
+) -> list[str]:
+    """MarkdownV2 chunks for a topic: the summary, then one per headline."""
+    summary_chunks = [
+        f"*{escape_markdown_v2(summary)}*\n{escape_markdown_v2('-'*50)}\n"
+    ]
+    for i, headline_idx in enumerate(headline_idxs):
+        selected = headlines[headline_idx]
+        escaped_title = escape_markdown_v2(selected.title)
+        escaped_publisher = escape_markdown_v2(selected.publisher)
+        escaped_summary = escape_markdown_v2(selected.summary).replace("\n", "\n> ")
+        summary_chunks.append(
+            f"{i + 1}\\. [*{escaped_title}*]({selected.link}) \\- _{escaped_publisher}_\n"
+            f">{escaped_summary}||\n\n"
+        )
+    return summary_chunks
+
+
+@dataclass
+class Edition:
+    last_updated: datetime
+    # Pre-rendered topics for subscribers without filters
+    summaries: list[list[str]]
+    # [{"topic": ..., "summary": ..., "headlines": [idx, ...]}, ...]
+    topics: list[dict] = field(default_factory=list)
+    headlines: list[Headline] = field(default_factory=list)
+    _index: HeadlineIndex = field(default=None, repr=False)
+
+    @classmethod
+    def load(cls, filename: str = Config.SUMMARIES_FILE) -> "Edition":
+        return cls.from_dict(load_json(filename))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Edition":
+        return cls(
+            last_updated=str_to_datetime(data["last_updated"]),
+            summaries=data["summaries"],
+            topics=data.get("topics", []),
+            headlines=[Headline(**h) for h in data.get("headlines", [])],
+        )
+
+    @property
+    def index(self) -> HeadlineIndex:
+        # Built once per edition and shared by every subscriber.
+        if self._index is None:
+            self._index = HeadlineIndex(self.headlines)
+        return self._index
+
+    def personalise(
+        self, keywords: list[str], publishers: list[str]
+    ) -> list[list[str]]:
+        """Topics restricted to the headlines matching the subscriber's filters.
+
+        Matching headlines outside the five topics are collected into an extra
+        topic at the end.
+        """
+        if not (keywords or publishers) or not self.topics:
+            return self.summaries
+        matches = self.index.match(keywords, publishers)
+        per_topic = Config.HEADLINES_PER_TOPIC
+        summaries = []
+        in_topics = set()
+        for topic in self.topics:
+            topic_matches = [idx for idx in topic["headlines"] if idx in matches]
+            in_topics.update(topic["headlines"])
+            if topic_matches:
+                summaries.append(
+                    render_topic(
+                        topic["summary"],
+                        sorted(topic_matches[:per_topic]),
+                        self.headlines,
+                    )
+                )
+        others = sorted(matches - in_topics)[:per_topic]
+        if others:
+            summaries.append(
+                render_topic(MATCHED_TOPIC_SUMMARY, others, self.headlines)
+            )
+        return summaries
@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from core.cluster import NON_WORD_REGEX, char_ngrams
+from core.schema import Headline
+
+
+def normalize(text: str) -> str:
+    return NON_WORD_REGEX.sub("", text.lower())
+
+
+class HeadlineIndex:
+    """Inverted index over one edition's headlines.
+
+    Titles are indexed by character unigrams and bigrams, publishers by exact
+    name. A keyword lookup intersects the posting sets of its n-grams and
+    confirms the few candidates with a substring check.
+    """
+
+    def __init__(self, headlines: list[Headline]) -> None:
+        self.titles = [normalize(h.title) for h in headlines]
+        self.postings = defaultdict(set)
+        self.publishers = defaultdict(set)
+        for idx, (headline, title) in enumerate(zip(headlines, self.titles)):
+            for ngram in set(char_ngrams(title, ngram_range=(1, 2))):
+                self.postings[ngram].add(idx)
+            self.publishers[headline.publisher].add(idx)
+        self._cache = {}
+
+    def search(self, keyword: str) -> set[int]:
+        keyword = normalize(keyword)
+        if not keyword:
+            return set()
+        ngram_range = (1, 1) if len(keyword) == 1 else (2, 2)
+        postings = [
+            self.postings.get(g, set()) for g in set(char_ngrams(keyword, ngram_range))
+        ]
+        candidates = set.intersection(*sorted(postings, key=len))
+        return {idx for idx in candidates if keyword in self.titles[idx]}
+
+    def match(self, keywords: list[str], publishers: list[str]) -> set[int]:
+        """Headlines matching any keyword and any publisher.
+
+        An empty list means no filter on that field. Results are cached per
+        filter, since many subscribers share the same preferences.
+        """
+        key = (tuple(sorted(keywords)), tuple(sorted(publishers)))
+        if key not in self._cache:
+            matches = set(range(len(self.titles)))
+            if keywords:
+                matches &= set().union(*(self.search(k) for k in keywords))
+            if publishers:
+                matches &= set().union(
+                    *(self.publishers.get(p, set()) for p in publishers)
+                )
+            self._cache[key] = matches
+        return self._cache[key]
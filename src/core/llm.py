@@ -0,0 +1,266 @@
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+from logzero import logger
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AzureOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+from core.config import Config
+from helpers.llm_gateway_util import (
+    KeycloakTokenManager,
+    append_cert_to_cacert,
+    get_ssl_certificate,
+)
+
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APITimeoutError,
+    InternalServerError,
+    RateLimitError,
+)
+
+
+class LLMUnavailableError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stop sending requests to an endpoint after repeated failures.
+
+    After `failure_threshold` consecutive failures the breaker opens for
+    `reset_timeout` seconds. Requests are then let through again; a success
+    closes it, another failure re-opens it straight away.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = Config.LLM_BREAKER_FAILURES,
+        reset_timeout: float = Config.LLM_BREAKER_RESET_SEC,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        return time.time() - self.opened_at >= self.reset_timeout
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.time()
+
+
+@dataclass
+class Endpoint:
+    name: str
+    client: AzureOpenAI
+    deployment: str
+    get_headers: Callable[[], dict] = dict
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    latencies: deque = field(default_factory=lambda: deque(maxlen=50))
+
+    def hedge_delay(self) -> float:
+        """Latency percentile after which a backup request is sent."""
+        if len(self.latencies) < Config.LLM_HEDGE_MIN_SAMPLES:
+            return Config.LLM_HEDGE_DELAY_SEC
+        latencies = sorted(self.latencies)
+        idx = int(Config.LLM_HEDGE_PERCENTILE / 100 * (len(latencies) - 1))
+        return latencies[idx]
+
+    def create(self, timeout: float, **kwargs):
+        start_time = time.time()
+        completion = self.client.chat.completions.create(
+            model=self.deployment,
+            extra_headers=self.get_headers(),
+            timeout=timeout,
+            **kwargs,
+        )
+        self.latencies.append(time.time() - start_time)
+        return completion
+
+
+def gateway_endpoint() -> Endpoint:
+    llm_gateway_url = os.getenv("LLM_GATEWAY_URL")
+    proxy_url = f"{llm_gateway_url}/models/proxy"
+    _ = append_cert_to_cacert(get_ssl_certificate(proxy_url))
+    token_mgr = KeycloakTokenManager(
+        keycloak_client_id=os.getenv("KEYCLOAK_CLIENT_ID"),
+        keycloak_client_secret=os.getenv("KEYCLOAK_CLIENT_SECRET"),
+    )
+    return Endpoint(
+        name="gateway",
+        client=AzureOpenAI(
+            api_key="some key",
+            azure_endpoint=llm_gateway_url,
+            api_version="2024-05-13",
+            max_retries=0,
+        ),
+        deployment="gpt-4o-deploy-gs",
+        get_headers=lambda: {
+            "Authorization": f"Bearer {token_mgr.kc_get_access_token()}"
+        },
+    )
+
+
+def azure_endpoint() -> Endpoint:
+    return Endpoint(
+        name="azure",
+        client=AzureOpenAI(
+            api_key=os.getenv("AZURE_GPT4V_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_GPT4O_ENDPOINT"),
+            api_version="2024-02-01",
+            max_retries=0,
+        ),
+        deployment="gpt-4o-deploy",
+    )
+
+
+ENDPOINT_FACTORIES = {
+    "gateway": (gateway_endpoint, "LLM_GATEWAY_URL"),
+    "azure": (azure_endpoint, "AZURE_GPT4O_ENDPOINT"),
+}
+
+
+class LLMRouter:
+    """Chat completions with an overall deadline, hedging and circuit breakers.
+
+    The first available endpoint in `Config.LLM_ENDPOINTS` gets the request.
+    If it has not answered within its hedge delay, or fails in any way, the
+    same request is also sent to the next available endpoint and the first
+    answer wins. Retryable errors are retried with jittered backoff while the
+    deadline allows; other errors are raised once every endpoint has failed.
+    """
+
+    def __init__(self, endpoint_names: list[str] = Config.LLM_ENDPOINTS) -> None:
+        self.endpoint_names = endpoint_names
+        self._endpoints = {}
+        # Endpoint name -> time its construction last failed
+        self._build_failures = {}
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(endpoint_names))
+
+    @property
+    def endpoints(self) -> list[Endpoint]:
+        # Built lazily: the gateway needs network access to set up its cert.
+        # Endpoints that fail to build are retried after the breaker timeout.
+        for name in self.endpoint_names:
+            if name in self._endpoints:
+                continue
+            failed_at = self._build_failures.get(name)
+            if failed_at and time.time() - failed_at < Config.LLM_BREAKER_RESET_SEC:
+                continue
+            factory, required_env = ENDPOINT_FACTORIES[name]
+            if not os.getenv(required_env):
+                if name not in self._build_failures:
+                    logger.warning(f"{required_env} not set. Endpoint {name} disabled.")
+                self._build_failures[name] = time.time()
+                continue
+            try:
+                self._endpoints[name] = factory()
+            except Exception as e:
+                logger.warning(
+                    f"Cannot set up endpoint {name}: {type(e).__name__}: {e}"
+                )
+                self._build_failures[name] = time.time()
+        return [self._endpoints[n] for n in self.endpoint_names if n in self._endpoints]
+
+    def available_endpoints(self) -> list[Endpoint]:
+        return [e for e in self.endpoints if e.breaker.allow()]
+
+    def complete(self, deadline: float = None, **kwargs):
+        """Return `(completion, endpoint_name)` or raise once `deadline` passes.
+
+        `deadline` is an absolute `time.time()` value, defaulting to
+        `Config.LLM_DEADLINE_SEC` from now.
+        """
+        if deadline is None:
+            deadline = time.time() + Config.LLM_DEADLINE_SEC
+        attempt = 0
+        last_error = None
+        while time.time() < deadline:
+            endpoints = self.available_endpoints()
+            if not endpoints:
+                raise LLMUnavailableError("No LLM endpoint available.")
+            try:
+                return self._hedged_request(endpoints, deadline, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                attempt += 1
+                wait_sec = min(
+                    random.uniform(0, 2**attempt), 60, max(deadline - time.time(), 0)
+                )
+                logger.warning(
+                    f"LLM attempt {attempt} failed ({type(e).__name__}). "
+                    f"Retrying in {wait_sec:.1f}s."
+                )
+                time.sleep(wait_sec)
+        raise LLMUnavailableError(
+            f"No LLM response before the deadline. Last error: {last_error}"
+        )
+
+    def _submit(self, endpoint: Endpoint, deadline: float, **kwargs) -> Future:
+        timeout = max(deadline - time.time(), 1)
+        logger.info(f"Sending LLM request to {endpoint.name}.")
+        return self._executor.submit(endpoint.create, timeout, **kwargs)
+
+    def _hedged_request(self, endpoints: list[Endpoint], deadline: float, **kwargs):
+        primary, backups = endpoints[0], endpoints[1:]
+        futures = {self._submit(primary, deadline, **kwargs): primary}
+        hedge_at = time.time() + primary.hedge_delay()
+        errors = []
+
+        while futures:
+            now = time.time()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if backups:
+                timeout = min(timeout, max(hedge_at - now, 0))
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                endpoint = futures.pop(future)
+                try:
+                    completion = future.result()
+                except Exception as e:
+                    # Includes failures outside the HTTP call, e.g. auth.
+                    endpoint.breaker.record_failure()
+                    logger.warning(f"{endpoint.name} failed: {type(e).__name__}: {e}")
+                    errors.append(e)
+                    continue
+                endpoint.breaker.record_success()
+                return completion, endpoint.name
+
+            # Hedge on slowness, or fail over straight away on errors.
+            if backups and (time.time() >= hedge_at or not futures):
+                backup = backups.pop(0)
+                logger.info(f"Hedging LLM request to {backup.name}.")
+                futures[self._submit(backup, deadline, **kwargs)] = backup
+
+        for endpoint in futures.values():
+            # Still running at the deadline: count as a failure for the breaker.
+            endpoint.breaker.record_failure()
+        if errors and not futures:
+            # Every endpoint tried has failed. Retry only if some error is
+            # transient, otherwise surface the first permanent one.
+            retryable = [e for e in errors if isinstance(e, RETRYABLE_ERRORS)]
+            if retryable:
+                raise retryable[-1]
+            raise errors[0]
+        raise LLMUnavailableError("No LLM response before the deadline.")
@@ -0,0 +1,205 @@
+import json
+from typing import Any
+
+from helpers.utils import capture_code
+
+SUMMARY_KEY = "總結"
+INDEXES_KEY = "標題索引"
+TOPIC_KEY = "話題"
+CLOSERS = {"{": "}", "[": "]"}
+# Placeholders copied from the prompt's example
+ELLIPSES = ("…", "...")
+
+
+class ResponseParseError(ValueError):
+    pass
+
+
+def repair_json(text: str) -> str:
+    """Fix the JSON defects LLMs commonly produce, outside of strings.
+
+    Handles surrounding prose, trailing commas, `…` placeholders, arrays of
+    `"key": value` pairs (turned into objects), mismatched closing brackets
+    and output truncated before the closing brackets. Truncation inside a
+    member drops that member back to the last complete one.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ResponseParseError("No JSON object in response.")
+    text = text[min(starts) :]
+
+    out = []
+    # [opener, position in `out`, position of its last `,`] of each open bracket
+    stack = []
+    in_string = escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in CLOSERS:
+            stack.append([char, len(out), None])
+            out.append(char)
+        elif char in "}]":
+            strip_trailing_comma(out)
+            if stack:
+                opener, _, _ = stack.pop()
+                out.append(CLOSERS[opener])
+            if not stack:
+                break
+        elif char == "," and stack:
+            stack[-1][2] = len(out)
+            out.append(char)
+        elif char == ":" and stack and stack[-1][0] == "[":
+            # `[ "key": {...} ]`: the array was meant to be an object.
+            stack[-1][0] = "{"
+            out[stack[-1][1]] = "{"
+            out.append(char)
+        elif text.startswith(ELLIPSES, i):
+            i += 3 if text.startswith("...", i) else 1
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    if not stack:
+        return "".join(out)
+    # Truncated: close what is open, or else cut back to the last complete
+    # member, innermost bracket first.
+    if in_string:
+        out.append('"')
+    strip_trailing_comma(out)
+    if out and out[-1] == ":":
+        out.append("null")
+    repaired = close_brackets(out, stack)
+    for depth in reversed(range(len(stack))):
+        try:
+            json.loads(repaired)
+            break
+        except json.JSONDecodeError:
+            pass
+        last_comma = stack[depth][2]
+        if last_comma is not None:
+            repaired = close_brackets(out[:last_comma], stack[: depth + 1])
+    return repaired
+
+
+def close_brackets(out: list[str], stack: list) -> str:
+    out = list(out)
+    for opener, _, _ in reversed(stack):
+        strip_trailing_comma(out)
+        out.append(CLOSERS[opener])
+    return "".join(out)
+
+
+def strip_trailing_comma(out: list[str]) -> None:
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def load_response_json(response_content: str) -> Any:
+    response_content = capture_code(response_content, "json")
+    try:
+        return json.loads(response_content)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(response_content))
+    except json.JSONDecodeError as e:
+        raise ResponseParseError(f"Cannot repair response JSON: {e}") from e
+
+
+def to_topic_dict(data: Any) -> dict:
+    """Normalise the shapes the topics come back in to `{key: details}`."""
+    if isinstance(data, list):
+        topics = {}
+        for i, item in enumerate(data):
+            if not isinstance(item, dict):
+                continue
+            if SUMMARY_KEY in item:
+                topics[str(item.get(TOPIC_KEY) or i)] = item
+            else:
+                topics.update(item)
+        return topics
+    if isinstance(data, dict):
+        # Unwrap a single wrapper key such as {"topics": {...}}
+        if len(data) == 1:
+            (value,) = data.values()
+            if isinstance(value, (dict, list)) and SUMMARY_KEY not in value:
+                inner = to_topic_dict(value)
+                if inner and all(isinstance(v, dict) for v in inner.values()):
+                    return inner
+        return data
+    raise ResponseParseError(f"Unexpected response type {type(data).__name__}.")
+
+
+def clean_summary(details: Any) -> str | None:
+    if not isinstance(details, dict):
+        return None
+    summary = details.get(SUMMARY_KEY)
+    if not isinstance(summary, str) or not summary.strip():
+        return None
+    return summary.strip()
+
+
+def clean_indexes(indexes: Any, n_headlines: int) -> list[int]:
+    """Valid, de-duplicated headline indexes in their original order."""
+    if not isinstance(indexes, list):
+        indexes = [indexes]
+    cleaned = []
+    for idx in indexes:
+        try:
+            # Also accepts "3" and "3: title"
+            idx = int(str(idx).split(":")[0].strip())
+        except ValueError:
+            continue
+        if 0 <= idx < n_headlines and idx not in cleaned:
+            cleaned.append(idx)
+    return cleaned
+
+
+def validate_topics(data: Any, n_headlines: int) -> tuple[dict, list[str]]:
+    """Split topics into valid ones and the names of those needing a re-prompt.
+
+    A topic is valid with a non-empty summary and at least one in-range
+    headline index. Bad indexes are dropped.
+    """
+    topics, failed = {}, []
+    for topic, details in to_topic_dict(data).items():
+        summary = clean_summary(details)
+        indexes = (
+            clean_indexes(details.get(INDEXES_KEY), n_headlines) if summary else []
+        )
+        if summary and indexes:
+            topics[topic] = {SUMMARY_KEY: summary, INDEXES_KEY: indexes}
+        else:
+            failed.append(topic)
+    return topics, failed
+
+
+def validate_cluster_topics(data: Any, n_clusters: int) -> tuple[dict, list[int]]:
+    """Map cluster number to `{"話題", "總結"}`, listing clusters without a summary."""
+    named = to_topic_dict(data)
+    topics, failed = {}, []
+    for cluster_idx in range(n_clusters):
+        details = named.get(str(cluster_idx), named.get(f"{TOPIC_KEY}{cluster_idx}"))
+        summary = clean_summary(details)
+        if summary is None:
+            failed.append(cluster_idx)
+            continue
+        topic = details.get(TOPIC_KEY)
+        if not isinstance(topic, str) or not topic.strip():
+            topic = f"{TOPIC_KEY}{cluster_idx}"
+        topics[cluster_idx] = {TOPIC_KEY: topic.strip(), SUMMARY_KEY: summary}
+    return topics, failed
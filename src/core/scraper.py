@@ -17,6 +17,59 @@ from core.config import Config
 from core.schema import Headline, to_serializable
 from helpers.utils import datetime_to_str, save_as_json
 
+HTML_PARSER = etree.HTMLParser()
+STREAM_ITEM_XPATH = etree.XPath(
+    "//li[not(contains(@class, 'StreamAd'))]/div/div/div/div[position() = (last() - 1)]"
+)
+AD_SUMMARY = "為您搜羅最新熱門搜尋資訊，立即查看！睇更多"
+
+
+def strip(text):
+    if text is None:
+        return ""
+    return text.strip()
+
+
+def parse_headlines(html: str, base_url: str) -> list[Headline]:
+    """Extract headlines from the stream container HTML in a single pass.
+
+    Each stream item holds an <h3> title link, a <p> summary and a
+    "publisher • time" <div>; only the first of each is used.
+    """
+    tree = etree.fromstring(html, HTML_PARSER)
+    if tree is None:
+        return []
+    headlines = []
+    for e in STREAM_ITEM_XPATH(tree):
+        h3 = p = div = None
+        for child in e:
+            tag = child.tag
+            if tag == "h3" and h3 is None:
+                h3 = child
+            elif tag == "p" and p is None:
+                p = child
+            elif tag == "div" and div is None:
+                div = child
+        if h3 is None or p is None or div is None:
+            continue
+        summary = strip(p.text)
+        if summary == AD_SUMMARY:
+            continue
+        a = h3.find("a")
+        if a is None:
+            continue
+        publisher, _, time = strip(div.text).partition(" • ")
+        headlines.append(
+            Headline(
+                publisher=publisher,
+                time=time,
+                title=strip("".join(h3.itertext())),
+                link=unquote(base_url + a.get("href", "")),
+                summary=summary,
+            )
+        )
+    return headlines
+
 
 def prettyprint_etree(element):
     xml = etree.tostring(element, pretty_print=True, encoding="utf-8")
@@ -136,11 +189,20 @@ class BaseDriver:
         res = self.driver.get(url)
         return res
 
+    def get_html_by_id(self, id):
+        # One round trip instead of a WebDriverWait poll plus get_attribute.
+        html = self.driver.execute_script(
+            "const e = document.getElementById(arguments[0]);"
+            "return e === null ? null : e.innerHTML;",
+            id,
+        )
+        if html is None:
+            element = self.get_element_by_id(id)
+            html = self.driver.execute_script("return arguments[0].innerHTML;", element)
+        return html
+
     def get_tree_by_id(self, id):
-        element = self.get_element_by_id(id)
-        parser = etree.HTMLParser()
-        tree = etree.parse(StringIO(element.get_attribute("innerHTML")), parser)
-        return tree
+        return etree.parse(StringIO(self.get_html_by_id(id)), HTML_PARSER)
 
     @retry(stop=stop_after_attempt(3))
     def get_element_by_id(self, id):
@@ -169,9 +231,8 @@ class BaseDriver:
 
     def get_tree_by_xpath(self, xpath):
         element = self.get_element_by_xpath(xpath)
-        parser = etree.HTMLParser()
-        tree = etree.parse(StringIO(element.get_attribute("innerHTML")), parser)
-        return tree
+        html = self.driver.execute_script("return arguments[0].innerHTML;", element)
+        return etree.parse(StringIO(html), HTML_PARSER)
 
     def get_table_text(self, cell):
         if list(cell) == []:
@@ -240,11 +301,7 @@ class YahooNewsDriver(BaseDriver):
         BaseDriver.__init__(self, **kwargs)
         self.base_url = "https://hk.news.yahoo.com"
 
-    @staticmethod
-    def strip(text):
-        if text is None:
-            return ""
-        return text.strip()
+    strip = staticmethod(strip)
 
     def get_headlines(self, category="archive"):
         self.get(f"{self.base_url}/{category}")
@@ -252,28 +309,9 @@ class YahooNewsDriver(BaseDriver):
             scroll_times=7, container_id="stream-container-scroll-template"
         )
 
-        tree = self.get_tree_by_id("stream-container-scroll-template")
-        elements = tree.xpath(
-            "//li[not(contains(@class, 'StreamAd'))]/div/div/div/div[position() = (last() - 1)]"
-        )
-        headlines = []
-        for e in elements:
-            summary = self.strip(e.xpath("./p")[0].text)
-            if summary == "為您搜羅最新熱門搜尋資訊，立即查看！睇更多":
-                continue
-            title = self.strip("".join(e.xpath("./h3")[0].itertext()))
-            logger.info(title)
-            publisher, time = self.strip(e.xpath("./div")[0].text).split(" • ")
-            headlines.append(
-                Headline(
-                    publisher=publisher,
-                    time=time,
-                    title=title,
-                    link=unquote(self.base_url + e.xpath("./h3/a")[0].get("href")),
-                    summary=summary,
-                )
-            )
-
+        html = self.get_html_by_id("stream-container-scroll-template")
+        headlines = parse_headlines(html, self.base_url)
+        logger.info(f"Parsed {len(headlines)} headlines from stream.")
         return headlines
 
 
@@ -294,6 +332,5 @@ def scrape_headlines(headless=True):
     return headlines
 
 
-
 if __name__ == "__main__":
     scrape_headlines(headless=False)
@@ -1,174 +1,355 @@
-import json
-import logging
-import os
-import re
+import asyncio
 import time
-from datetime import datetime
+from dataclasses import asdict
+from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
 from logzero import logger
-from openai import AzureOpenAI, RateLimitError
-from tenacity import (
-    after_log,
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_random_exponential,
-)
 
+from core.archive import EditionArchive
+from core.articles import fetch_articles
+from core.cluster import Cluster, cluster_headlines
 from core.config import Config
-from core.schema import Headline
-from core.scraper import scrape_headlines
-from helpers.llm_gateway_util import (
-    KeycloakTokenManager,
-    append_cert_to_cacert,
-    get_ssl_certificate,
+from core.edition import render_topic
+from core.llm import LLMRouter
+from core.response import (
+    ResponseParseError,
+    load_response_json,
+    validate_cluster_topics,
+    validate_topics,
 )
-from helpers.utils import capture_code, datetime_to_str, save_as_json
+from core.schema import Headline, to_serializable
+from core.scraper import scrape_headlines
+from helpers.utils import datetime_to_str, save_as_json
 
 load_dotenv()
 
-DEPLOYMENT_NAME = "gpt-4o-deploy-gs"
-API_VERSION = "2024-05-13"
 SYSTEM_PROMPT = "You are a helpful Trditional Chinese AI assistant that summarizes news headlines and response only in JSON format."
-USE_LLM_GATEWAY = True
-
-if USE_LLM_GATEWAY:
-    DEPLOYMENT_NAME = "gpt-4o-deploy-gs"
-    API_VERSION = "2024-05-13"
-    llm_gateway_url = os.getenv("LLM_GATEWAY_URL")
-    keycloak_client_id = os.getenv("KEYCLOAK_CLIENT_ID")
-    keycloak_client_secret = os.getenv("KEYCLOAK_CLIENT_SECRET")
-
-    proxy_url = f"{llm_gateway_url}/models/proxy"
-    _ = append_cert_to_cacert(get_ssl_certificate(proxy_url))
-    token_mgr = KeycloakTokenManager(
-        keycloak_client_id=keycloak_client_id,
-        keycloak_client_secret=keycloak_client_secret,
-    )
-    azure_openai_client = AzureOpenAI(
-        api_key="some key",
-        azure_endpoint=llm_gateway_url,
-        api_version=API_VERSION,
-    )
 
-else:
-    DEPLOYMENT_NAME = "gpt-4o-deploy"
-    API_VERSION = "2024-02-01"
-    AzureOpenAI(
-        api_key=os.getenv("AZURE_GPT4V_API_KEY"),
-        azure_endpoint=(os.getenv("AZURE_GPT4O_ENDPOINT")),
-        api_version=API_VERSION,
-    )
+llm_router = LLMRouter()
+
+
+def get_headline_context(headline: Headline, articles: dict[str, str]) -> str:
+    context = articles.get(headline.link) or headline.summary
+    context = " ".join(context.split())
+    return context[: Config.ARTICLE_EXCERPT_CHARS]
 
 
-def get_user_prompt(headlines: list[Headline]):
-    headlines_string = [f"{idx}: {h.title}" for idx, h in enumerate(headlines)]
+def get_headlines_block(headlines: list[Headline], articles: dict[str, str] = None):
+    if articles is None:
+        headlines_string = [f"{idx}: {h.title}" for idx, h in enumerate(headlines)]
+    else:
+        headlines_string = [
+            f"{idx}: {h.title}\n    {get_headline_context(h, articles)}"
+            for idx, h in enumerate(headlines)
+        ]
     headlines_string = "\n".join(headlines_string)
     return f"""<新聞標題>
 {headlines_string}
 </新聞標題>
-以上新聞標題由不同來源發布，請找出五個最熱門的話題/關鍵字。
+"""
+
+
+def get_user_prompt(headlines: list[Headline], articles: dict[str, str] = None):
+    return f"""{get_headlines_block(headlines, articles)}以上新聞標題由不同來源發布，請找出五個最熱門的話題/關鍵字。
 對於每個主題/關鍵字，請提供一個簡短的總結，並提供與之相關的新聞標題的索引。
 請按以下JSON格式回答：
-[
+{{
     "話題/關鍵字": {{
         "總結": "關於話題/關鍵字的簡短總結。",
-        "標題索引": [0,2,3,...],
+        "標題索引": [0,2,3,...]
     }},
     "話題/關鍵字": {{
         "總結": "關於話題/關鍵字的簡短總結。",
-        "標題索引": [5,10,11,...],
+        "標題索引": [5,10,11,...]
     }},
     …
-]
+}}
 """
 
 
-def escape_markdown_v2(text):
-    """Escape special characters for MarkdownV2."""
-    escape_chars = r"_*[]()~`>#+-=|{}.!"
-    return re.sub(r"(?<!\\)([{}])".format(re.escape(escape_chars)), r"\\\1", text)
-
-
-def enrich_response(response_content: str, headlines: list[Headline]):
-    response_content = capture_code(response_content, "json")
-    response_json = json.loads(response_content)
-    rich_responses = []
-    for topic, details in response_json.items():
-        summary_chunks = []
-        summary_chunks.append(
-            f"*{escape_markdown_v2(details['總結'])}*\n{escape_markdown_v2('-'*50)}\n"
-        )
-        topic_headlines = sorted([int(idx) for idx in details["標題索引"]])[:5]
-        for i, headline_idx in enumerate(topic_headlines):
-            selected = headlines[headline_idx]
-            escaped_title = escape_markdown_v2(selected.title)
-            escaped_publisher = escape_markdown_v2(selected.publisher)
-            escaped_summary = escape_markdown_v2(selected.summary).replace("\n", "\n> ")
-            summary_chunks.append(
-                f"{i + 1}\. [*{escaped_title}*]({selected.link}) \- _{escaped_publisher}_\n"
-                f">{escaped_summary}||\n\n"
+def get_cluster_prompt(
+    headlines: list[Headline], clusters: list[Cluster], articles: dict[str, str]
+):
+    clusters_string = []
+    for cluster_idx, cluster in enumerate(clusters):
+        clusters_string.append(f"話題{cluster_idx}:")
+        for idx in cluster.representatives:
+            h = headlines[idx]
+            clusters_string.append(
+                f"- {h.title}\n    {get_headline_context(h, articles)}"
             )
-        rich_responses.append(summary_chunks)
-    return rich_responses
+    clusters_string = "\n".join(clusters_string)
+    return f"""<新聞話題>
+{clusters_string}
+</新聞話題>
+以上每個話題列出了幾個屬於同一話題的新聞標題。
+請為每個話題提供一個關鍵字及簡短的總結。
+請按以下JSON格式回答，以話題編號作為鍵：
+{{
+    "0": {{
+        "話題": "關鍵字",
+        "總結": "關於話題的簡短總結。"
+    }},
+    "1": {{
+        "話題": "關鍵字",
+        "總結": "關於話題的簡短總結。"
+    }},
+    …
+}}
+"""
 
 
-@retry(
-    wait=wait_random_exponential(min=1, max=60),
-    stop=stop_after_attempt(6),
-    retry=retry_if_exception_type(RateLimitError),
-    after=after_log(logger, logging.INFO),
-    reraise=True,
-)
-def completion_with_retry(**kwargs):
-    return azure_openai_client.chat.completions.create(**kwargs)
+def get_topic_retry_prompt(
+    headlines: list[Headline], topics: list[str], articles: dict[str, str]
+):
+    topics_string = "、".join(f"「{topic}」" for topic in topics)
+    return f"""{get_headlines_block(headlines, articles)}以上新聞標題由不同來源發布。請只針對以下話題：{topics_string}，
+提供一個簡短的總結，並提供與之相關的新聞標題的索引。
+請按以下JSON格式回答：
+{{
+    "話題": {{
+        "總結": "關於話題的簡短總結。",
+        "標題索引": [0,2,3,...]
+    }}
+}}
+"""
 
 
-def summarize():
-    headlines = scrape_headlines()
+def get_edition_deadline(now: datetime = None) -> float:
+    """Timestamp the edition must be ready by: just before the next send job."""
+    now = now or datetime.now(Config.TIMEZONE)
+    send_times = [
+        Config.TIMEZONE.localize(datetime.combine(day, send_time.replace(tzinfo=None)))
+        for day in (now.date(), now.date() + timedelta(days=1))
+        for send_time in Config.SEND_SCHEDULE
+    ]
+    next_send = min(t for t in send_times if t > now)
+    return next_send.timestamp() - Config.EDITION_DEADLINE_MARGIN_SEC
 
-    start_time = time.time()
-    completion = completion_with_retry(
+
+def request_completion(user_prompt: str, deadline: float):
+    return llm_router.complete(
+        deadline=deadline,
         messages=[
             {"role": "system", "content": [{"type": "text", "text": SYSTEM_PROMPT}]},
             {
                 "role": "user",
-                "content": [{"type": "text", "text": get_user_prompt(headlines)}],
+                "content": [{"type": "text", "text": user_prompt}],
             },
         ],
-        model=DEPLOYMENT_NAME,
-        extra_headers=(
-            {"Authorization": f"Bearer {token_mgr.kc_get_access_token()}"}
-            if USE_LLM_GATEWAY
-            else {}
-        ),
         temperature=0,
         seed=2024,
         max_tokens=4096,
         response_format={"type": "json_object"},
     )
 
+
+def parse_topics(response: str, n_headlines: int) -> tuple[dict, list[str]]:
+    try:
+        return validate_topics(load_response_json(response), n_headlines)
+    except ResponseParseError as e:
+        logger.warning(f"Cannot parse LLM response: {e}")
+        return {}, []
+
+
+def parse_cluster_topics(response: str, n_clusters: int) -> tuple[dict, list[int]]:
+    try:
+        return validate_cluster_topics(load_response_json(response), n_clusters)
+    except ResponseParseError as e:
+        logger.warning(f"Cannot parse LLM response: {e}")
+        return {}, list(range(n_clusters))
+
+
+def summarize_clusters(
+    response: str,
+    headlines: list[Headline],
+    clusters: list[Cluster],
+    articles: dict[str, str],
+    deadline: float,
+) -> tuple[dict, int]:
+    """Topics named by the LLM with their headlines from local clustering.
+
+    Clusters the response has no usable summary for are re-prompted on their
+    own while the deadline allows. Returns the topics and the number of
+    re-prompts.
+    """
+    named, failed = parse_cluster_topics(response, len(clusters))
+    retries = 0
+    while failed and retries < Config.LLM_REPAIR_ATTEMPTS and time.time() < deadline:
+        retries += 1
+        logger.warning(f"Re-prompting for clusters {failed}.")
+        retry_clusters = [clusters[i] for i in failed]
+        try:
+            completion, _ = request_completion(
+                get_cluster_prompt(headlines, retry_clusters, articles), deadline
+            )
+        except Exception as e:
+            # Includes non-retryable endpoint errors; keep what already validated.
+            logger.warning(f"Re-prompt abandoned: {e!r}")
+            break
+        retried, _ = parse_cluster_topics(
+            completion.choices[0].message.content, len(retry_clusters)
+        )
+        for retry_idx, details in retried.items():
+            named[failed[retry_idx]] = details
+        failed = [i for i in failed if i not in named]
+
+    topics = {}
+    for cluster_idx, cluster in enumerate(clusters):
+        if cluster_idx not in named:
+            logger.warning(f"No summary for cluster {cluster_idx}. Skipped.")
+            continue
+        details = named[cluster_idx]
+        topic = details["話題"]
+        if topic in topics:
+            # Close clusters can come back with the same name.
+            topic = f"{topic} #{cluster_idx}"
+        topics[topic] = {
+            "總結": details["總結"],
+            "標題索引": cluster.indexes,
+        }
+    return topics, retries
+
+
+def summarize_topics(
+    response: str,
+    headlines: list[Headline],
+    articles: dict[str, str],
+    deadline: float,
+) -> tuple[dict, int]:
+    """Validated topics from the LLM, re-prompting only for the invalid ones.
+
+    Only the requested topics are taken from a targeted re-prompt. A response
+    with nothing usable is re-prompted in full.
+    """
+    topics, failed = parse_topics(response, len(headlines))
+    retries = 0
+    while (
+        (failed or not topics)
+        and retries < Config.LLM_REPAIR_ATTEMPTS
+        and time.time() < deadline
+    ):
+        retries += 1
+        if topics:
+            logger.warning(f"Re-prompting for topics {failed}.")
+            prompt = get_topic_retry_prompt(headlines, failed, articles)
+        else:
+            logger.warning("Re-prompting for all topics.")
+            prompt = get_user_prompt(headlines, articles)
+        try:
+            completion, _ = request_completion(prompt, deadline)
+        except Exception as e:
+            # Includes non-retryable endpoint errors; keep what already validated.
+            logger.warning(f"Re-prompt abandoned: {e!r}")
+            break
+        retried, retry_failed = parse_topics(
+            completion.choices[0].message.content, len(headlines)
+        )
+        if not topics:
+            topics, failed = retried, retry_failed
+            continue
+        unexpected = [topic for topic in retried if topic not in failed]
+        if unexpected:
+            logger.warning(f"Ignoring topics {unexpected} not asked for.")
+        for topic in failed:
+            if topic in retried:
+                topics[topic] = retried[topic]
+        failed = [topic for topic in failed if topic not in topics]
+    if failed:
+        logger.warning(f"Topics {failed} still invalid. Skipped.")
+    return topics, retries
+
+
+def get_topic_headlines(details: dict, headlines: list[Headline]) -> list[int]:
+    """Headline indexes of a topic, most relevant first, dropping bad indexes."""
+    idxs = []
+    for idx in details["標題索引"]:
+        if 0 <= idx < len(headlines) and idx not in idxs:
+            idxs.append(idx)
+    return idxs
+
+
+def enrich_response(topics: dict, headlines: list[Headline]):
+    rich_responses = []
+    for topic, details in topics.items():
+        topic_headlines = get_topic_headlines(details, headlines)
+        rich_responses.append(
+            render_topic(
+                details["總結"],
+                sorted(topic_headlines[: Config.HEADLINES_PER_TOPIC]),
+                headlines,
+            )
+        )
+    return rich_responses
+
+
+def summarize(archive: EditionArchive = None):
+    # One deadline for the whole edition: scraping, article fetching, the
+    # LLM call and any re-prompts.
+    deadline = get_edition_deadline()
+    headlines = scrape_headlines()
+    fetch_budget = min(
+        Config.ARTICLE_FETCH_BUDGET_SEC,
+        max(deadline - time.time() - Config.LLM_RESERVED_SEC, 0),
+    )
+    if Config.USE_PRECLUSTERING:
+        # Clustering only needs titles; fetch articles for what the prompt shows.
+        clusters = cluster_headlines(headlines)
+        shown = [headlines[idx] for c in clusters for idx in c.representatives]
+    else:
+        shown = headlines
+    articles, fetch_stats = asyncio.run(fetch_articles(shown, fetch_budget))
+    if Config.USE_PRECLUSTERING:
+        user_prompt = get_cluster_prompt(headlines, clusters, articles)
+    else:
+        user_prompt = get_user_prompt(headlines, articles)
+
+    start_time = time.time()
+    completion, endpoint = request_completion(user_prompt, deadline)
+
     response = completion.choices[0].message.content
     model = completion.model
     total_duration_sec = time.time() - start_time
 
-    logger.info(f"Model: {model}")
+    logger.info(f"Model: {model} via {endpoint}")
     logger.info(f"Total duration: {total_duration_sec:.2f} seconds")
 
-    rich_responses = enrich_response(response, headlines)
-
-    save_as_json(
-        {
-            "last_updated": datetime_to_str(datetime.now()),
-            "model": model,
-            "usage": completion.usage.to_dict(),
-            "duration": total_duration_sec,
-            "summaries": rich_responses,
-        },
-        Config.SUMMARIES_FILE,
+    if Config.USE_PRECLUSTERING:
+        topics, retries = summarize_clusters(
+            response, headlines, clusters, articles, deadline
+        )
+    else:
+        topics, retries = summarize_topics(response, headlines, articles, deadline)
+    rich_responses = enrich_response(topics, headlines)
+
+    edition = {
+        "last_updated": datetime_to_str(datetime.now()),
+        "model": model,
+        "endpoint": endpoint,
+        "usage": completion.usage.to_dict(),
+        "duration": total_duration_sec,
+        "repair_requests": retries,
+        "article_fetch": asdict(fetch_stats),
+        "summaries": rich_responses,
+        "topics": [
+            {
+                "topic": topic,
+                "summary": details["總結"],
+                "headlines": get_topic_headlines(details, headlines),
+            }
+            for topic, details in topics.items()
+        ],
+        "headlines": [to_serializable(h) for h in headlines],
+    }
+    save_as_json(edition, Config.SUMMARIES_FILE)
+    if archive is None:
+        archive = EditionArchive()
+    edition_id = archive.append(edition)
+    logger.info(
+        f"Summaries saved to {Config.SUMMARIES_FILE} "
+        f"and archived as edition {edition_id}."
     )
-    logger.info(f"Summaries saved to {Config.SUMMARIES_FILE}")
 
     return rich_responses
 
@@ -0,0 +1,191 @@
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+
+from logzero import logger
+
+from core.config import Config
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# tracemalloc and the profilers are process-wide, so only one job is
+# profiled at a time per process.
+_active_lock = threading.Lock()
+_active_job = None
+
+
+@dataclass
+class ProfileReport:
+    job: str
+    duration: float
+    peak_memory: int
+    task_count: int
+    peak_task_count: int
+    hotspots: str
+    memory_hotspots: str
+    profile_file: str
+
+    def to_message(self) -> str:
+        message = (
+            f"[Profile] {self.job} took {self.duration:.2f}s\n"
+            f"Peak traced memory: {self.peak_memory / 2**20:.1f} MiB\n"
+            f"Asyncio tasks: {self.task_count} at start, peak {self.peak_task_count}\n"
+            f"Full profile: {self.profile_file}\n\n"
+            f"Hotspots:\n{self.hotspots}\n\n"
+            f"Top allocations:\n{self.memory_hotspots}"
+        )
+        return message[:TELEGRAM_MESSAGE_LIMIT]
+
+
+class JobProfiler:
+    """Profile the next run of a scheduled job on request.
+
+    Arming drops a marker file in the shared profile directory so that
+    whichever worker runs the job next picks it up; removing the marker is
+    atomic, so only one worker profiles each arming. While a profiled run is
+    in progress, other jobs are not profiled and keep their marker for their
+    next run.
+    """
+
+    def __init__(self, output_dir: str = Config.PROFILE_DIR) -> None:
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _marker(self, job: str) -> str:
+        return os.path.join(self.output_dir, f"{job}.armed")
+
+    def arm(self, job: str) -> None:
+        with open(self._marker(job), "w", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\n")
+
+    def should_profile(self, job: str) -> bool:
+        """Claim the arming of `job`. A True result must be followed by `run`."""
+        global _active_job
+        if not os.path.exists(self._marker(job)):
+            return False
+        with _active_lock:
+            if _active_job is not None:
+                logger.warning(
+                    f"Skipped profiling {job}: {_active_job} is still being profiled."
+                )
+                return False
+            try:
+                os.remove(self._marker(job))
+            except FileNotFoundError:
+                return False
+            _active_job = job
+        return True
+
+    def _release(self) -> None:
+        global _active_job
+        with _active_lock:
+            _active_job = None
+
+    async def _sample_tasks(self, counts: list[int], interval: float = 0.1):
+        while True:
+            counts.append(len(asyncio.all_tasks()))
+            await asyncio.sleep(interval)
+
+    def _start_profiler(self):
+        if PyinstrumentProfiler is not None:
+            profiler = PyinstrumentProfiler(async_mode="enabled")
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler, job: str) -> tuple[str, str]:
+        filename = os.path.join(
+            self.output_dir, f"{job}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        if PyinstrumentProfiler is not None:
+            profiler.stop()
+            filename += ".html"
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            hotspots = profiler.output_text(unicode=True, show_all=False)
+        else:
+            profiler.disable()
+            filename += ".prof"
+            profiler.dump_stats(filename)
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(20)
+            hotspots = stream.getvalue().strip()
+        return hotspots, filename
+
+    def _run_in_thread(self, job: str, func, *args, **kwargs):
+        # Profilers only see the thread they are started in.
+        profiler = self._start_profiler()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            hotspots, profile_file = self._stop_profiler(profiler, job)
+        return result, hotspots, profile_file
+
+    async def run(self, job: str, func, *args, **kwargs):
+        """Run `func` under the profiler and return its result and a report.
+
+        Coroutine functions are awaited on the current loop, plain functions
+        are run in a worker thread. Only call this after `should_profile`.
+        """
+        try:
+            return await self._run(job, func, *args, **kwargs)
+        finally:
+            self._release()
+
+    async def _run(self, job: str, func, *args, **kwargs):
+        task_counts = [len(asyncio.all_tasks())]
+        sampler = asyncio.create_task(self._sample_tasks(task_counts))
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                profiler = self._start_profiler()
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    hotspots, profile_file = self._stop_profiler(profiler, job)
+            else:
+                result, hotspots, profile_file = await asyncio.to_thread(
+                    self._run_in_thread, job, func, *args, **kwargs
+                )
+        finally:
+            duration = time.perf_counter() - start_time
+            sampler.cancel()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        snapshot.dump(f"{os.path.splitext(profile_file)[0]}.tracemalloc")
+        top_stats = snapshot.statistics("lineno")[:5]
+        memory_hotspots = "\n".join(str(stat) for stat in top_stats)
+        report = ProfileReport(
+            job=job,
+            duration=duration,
+            peak_memory=peak_memory,
+            task_count=task_counts[0],
+            peak_task_count=max(task_counts),
+            hotspots=hotspots,
+            memory_hotspots=memory_hotspots,
+            profile_file=profile_file,
+        )
+        logger.info(
+            f"Profiled {job}: {duration:.2f}s, peak {peak_memory / 2**20:.1f} MiB. "
+            f"Saved to {profile_file}."
+        )
+        return result, report
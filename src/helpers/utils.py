@@ -1,12 +1,21 @@
+import asyncio
 import datetime
+import fcntl
 import json
+import os
 import re
+from contextlib import asynccontextmanager, contextmanager
 from typing import Any, List
 
 
 def save_as_json(data: Any, filename: str):
-    with open(filename, "w", encoding="utf-8") as f:
+    # Write to a temp file and rename so readers never see a partial file.
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
 
 
 def load_json(filename: str) -> List[Any]:
@@ -15,6 +24,42 @@ def load_json(filename: str) -> List[Any]:
     return data_dicts
 
 
+@contextmanager
+def file_lock(filename: str):
+    """Exclusive advisory lock on `filename`, shared across processes."""
+    with open(f"{filename}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@asynccontextmanager
+async def async_file_lock(filename: str, poll_interval: float = 0.1):
+    """`file_lock` for coroutines: polls instead of blocking the event loop."""
+    with open(f"{filename}.lock", "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def update_json(filename: str):
+    """Load, modify in place and save a JSON file under an exclusive lock."""
+    with file_lock(filename):
+        data = load_json(filename)
+        yield data
+        save_as_json(data, filename)
+
+
 def datetime_to_str(date_time: datetime.datetime) -> str:
     return date_time.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -0,0 +1,61 @@
+import fcntl
+import os
+import zlib
+
+from logzero import logger
+
+from core.config import Config
+
+
+class LeaderLock:
+    """Leader election between bot workers through a non-blocking file lock.
+
+    The first worker to take the lock keeps it until the process exits, so the
+    kernel releases it automatically if the leader dies and another worker can
+    take over at its next scheduled job.
+    """
+
+    def __init__(self, filename: str = Config.LEADER_LOCK_FILE) -> None:
+        self.filename = filename
+        self._lock_file = None
+
+    def is_leader(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.filename, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._lock_file = lock_file
+        logger.info(f"Worker {Config.WORKER_ID} is now the leader.")
+        return True
+
+
+def check_worker_config() -> None:
+    """Fail fast on a worker that would never own any chat."""
+    if Config.WORKER_COUNT < 1:
+        raise ValueError(f"WORKER_COUNT must be at least 1, got {Config.WORKER_COUNT}.")
+    if not 0 <= Config.WORKER_ID < Config.WORKER_COUNT:
+        raise ValueError(
+            f"WORKER_ID must be in [0, {Config.WORKER_COUNT}), got {Config.WORKER_ID}."
+        )
+
+
+def is_primary_worker() -> bool:
+    """Only one process may poll Telegram for updates per bot token."""
+    return Config.WORKER_ID == 0
+
+
+def is_own_chat(chat_id: str) -> bool:
+    """Whether `chat_id` falls in this worker's share of the broadcast.
+
+    Uses crc32 rather than `hash()` since the latter is salted per process.
+    """
+    shard = zlib.crc32(str(chat_id).encode("utf-8")) % Config.WORKER_COUNT
+    return shard == Config.WORKER_ID